@@ -1,8 +1,14 @@
 
 from __future__ import annotations
-import json, re, datetime
+import json, re, datetime, functools, io
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pac
 import networkx as nx
 from pyvis.network import Network
 from streamlit.components.v1 import html
@@ -17,62 +23,165 @@ try:
 except ModuleNotFoundError:
     USE_ACE = False
 
+# Optional NetworkX dispatch backend (GPU / GraphBLAS) for large graphs
+try:
+    import nx_cugraph  # noqa: F401
+    NX_BACKEND = "cugraph"
+except ImportError:  # also covers an installed package with no usable CUDA
+    try:
+        import graphblas_algorithms  # noqa: F401
+        NX_BACKEND = "graphblas"
+    except ImportError:
+        NX_BACKEND = None
+
 ACCENT = "#ff4b4b"
 NET_HEIGHT = 700  # px
+BTW_EXACT = 64    # nodes; larger graphs use sampled betweenness
+BTW_PIVOTS = 32
+BACKEND_MIN = 500 # nodes; below this dispatch overhead outweighs the backend
+TABLE_ROWS = 1000 # rows rendered in the Data tab unless expanded
+
+# Centralities ignore weights, so graphs are hashed by topology alone: playback
+# frames that only bump edge weights reuse the cached result
+GRAPH_HASH = {nx.DiGraph: lambda g: hash(frozenset(g.edges()))}
 
 # ─── Helpers ────────────────────────────────────────────────────
-def parse_events(raw: list[dict]) -> pd.DataFrame:
-    rows = []
-    for it in raw:
-        if it.get("topic") != "/capabilities/events": continue
-        m = it["msg"]; s = m["header"]["stamp"]
-        ts = s["secs"] + s["nsecs"] * 1e-9
-        src = m["source"]["capability"].strip()
-        tgt = m["target"]["capability"].strip() or src
-        txt = (m["target"]["text"] or "event").strip()
-        typ = txt.split(":")[0][:60]
-        if src:
-            rows.append(dict(timestamp=ts, source=src,
-                             target=tgt, type=typ, text=txt))
-    if not rows: return pd.DataFrame()
-    df = (pd.DataFrame(rows)
+@st.cache_data(show_spinner=False, max_entries=4)
+def parse_events(raw_text: str) -> pd.DataFrame:
+    raw = json.loads(raw_text)
+    # Pick out event messages first, then pull each field straight into a
+    # column; null capabilities count as empty, as in the old `or src`
+    ev = [it["msg"] for it in raw if it.get("topic") == "/capabilities/events"]
+    if not ev: return pd.DataFrame()
+    src = [(m["source"]["capability"] or "").strip() for m in ev]
+    tgt = [(m["target"]["capability"] or "").strip() or s for m, s in zip(ev, src)]
+    txt = [(m["target"]["text"] or "event").strip() for m in ev]
+    # Rebase whole seconds as integers first so float64 keeps nanosecond detail
+    secs = np.array([m["header"]["stamp"]["secs"] for m in ev], dtype=np.int64)
+    nsecs = np.array([m["header"]["stamp"]["nsecs"] for m in ev], dtype=np.int64)
+    rows = pd.DataFrame({
+        "timestamp": (secs - secs.min()) + nsecs * 1e-9,
+        "source": src,
+        "target": tgt,
+        "type": [t.split(":", 1)[0][:60] for t in txt],
+        "text": txt,
+    })
+    rows = rows[rows.source != ""]
+    if rows.empty: return pd.DataFrame()
+    df = (rows
           .sort_values("timestamp")
           .reset_index(drop=True))
     df["timestamp"] -= df["timestamp"].iloc[0]
-    return df
-
-def build_graph(df: pd.DataFrame, min_w: int):
-    agg = df.groupby(["source","target"]).size().reset_index(name="w")
-    agg = agg[agg.w >= min_w]
+    # Arrow-backed strings give groupby/isin/str.* native kernels
+    # (pyarrow ships with streamlit)
+    return df.astype({"source": "string[pyarrow]", "target": "string[pyarrow]",
+                      "type": "string[pyarrow]"})
+
+def pair_counts(df: pd.DataFrame) -> dict:
+    # (source, target) -> event count via integer pair codes and np.unique,
+    # avoiding a hash groupby over the string columns; memory stays O(rows)
+    if df.empty: return {}
+    s_codes, s_names = pd.factorize(df.source)
+    t_codes, t_names = pd.factorize(df.target)
+    ok = (s_codes >= 0) & (t_codes >= 0)  # factorize marks missing values -1
+    nt = len(t_names)
+    pair, w = np.unique(s_codes[ok].astype(np.int64) * nt + t_codes[ok],
+                        return_counts=True)
+    return dict(zip(zip(s_names[pair // nt], t_names[pair % nt]), w.tolist()))
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def edge_counts(raw_text: str) -> dict:
+    # Whole-log edge counts; only the slider range needs them
+    return pair_counts(parse_events(raw_text))
+
+def build_graph(counts: Counter, min_w: int):
+    agg = (pd.DataFrame([(s, t, w) for (s, t), w in counts.items() if w >= min_w],
+                        columns=["source","target","w"])
+           .sort_values(["source","target"], ignore_index=True))
     G = nx.DiGraph()
-    for _, r in agg.iterrows():
-        G.add_edge(r.source, r.target, weight=int(r.w))
-    for n in set(agg.source) | set(agg.target):
-        G.add_node(n)
+    G.add_weighted_edges_from(agg.itertuples(index=False, name=None))
     return G, agg
 
+@st.cache_data(show_spinner=False, max_entries=64, hash_funcs=GRAPH_HASH)
 def centralities(G: nx.DiGraph):
     if not G.nodes: return {}, {}, {}
-    deg = nx.degree_centrality(G)
-    btw = nx.betweenness_centrality(G)
-    try:
-        eig = nx.eigenvector_centrality_numpy(G)
-    except Exception:
-        eig = {n: 0 for n in G.nodes()}
-    return deg, btw, eig
+    n = G.number_of_nodes()
+    kw = dict(k=min(n, BTW_PIVOTS), seed=0, normalized=True) if n > BTW_EXACT else {}
+    def btw(G):
+        if NX_BACKEND and n > BACKEND_MIN:
+            try: return nx.betweenness_centrality(G, backend=NX_BACKEND, **kw)
+            except Exception: pass  # backend broken at runtime: use default
+        return nx.betweenness_centrality(G, **kw)
+    def eig(G):
+        try: return nx.eigenvector_centrality_numpy(G)
+        except Exception: return {n: 0 for n in G.nodes()}
+    jobs = (nx.degree_centrality, btw, eig)
+    # Default-backend betweenness is pure Python and holds the GIL, so only
+    # overlap the jobs when it is dispatched to a native backend
+    if not (NX_BACKEND and n > BACKEND_MIN): return tuple(f(G) for f in jobs)
+    with ThreadPoolExecutor(len(jobs)) as ex:
+        return tuple(ex.map(lambda f: f(G), jobs))
+
+@functools.lru_cache(maxsize=32)
+def _compiled(pat: str) -> re.Pattern:
+    try: return re.compile(pat, re.I)
+    except re.error: return re.compile(re.escape(pat), re.I)  # match literally
 
 def safe_regex(df: pd.DataFrame, pat: str):
-    if not pat: return df
-    try:
-        rx = re.compile(pat, re.I)
-        mask = df.source.str.contains(rx) | df.target.str.contains(rx)
-    except re.error:
-        mask = df.source.str.contains(pat, case=False) | \
-               df.target.str.contains(pat, case=False)
-    return df[mask]
+    if not pat or df.empty: return df
+    rx = _compiled(pat)
+    # Capability names repeat heavily: run the regex once per distinct name
+    names = pd.unique(pd.concat([df.source, df.target]))
+    hits = [n for n in names if rx.search(n)]
+    return df[df.source.isin(hits) | df.target.isin(hits)]
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def csv_bytes(df: pd.DataFrame) -> bytes:
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    # The CSV writer rounds floats to 9 digits; Arrow's string cast keeps the
+    # shortest round-trip form, as to_csv does
+    tbl = pa.table({c: pc.cast(a, pa.string()) if pa.types.is_floating(a.type) else a
+                    for c, a in zip(tbl.column_names, tbl.columns)})
+    buf = io.BytesIO()
+    try:  # unquoted like to_csv; "none" refuses values that need quoting
+        pac.write_csv(tbl, buf, pac.WriteOptions(quoting_style="none"))
+    except pa.ArrowInvalid:
+        buf = io.BytesIO()
+        pac.write_csv(tbl, buf, pac.WriteOptions(quoting_style="needed"))
+    return buf.getvalue()
 
 cut = lambda s,n: (s[:n]+"…") if n and len(s)>n>0 else s
 
+# Playback reruns often leave the graph untouched; reuse the generated page
+@st.cache_data(show_spinner=False, max_entries=8)
+def render_net(nodes: tuple, edges: tuple, style: tuple) -> str:
+    theme, layout, physics, arrows, lablen, spring, repel = style
+    net = Network(height=f"{NET_HEIGHT}px", width="100%", directed=True,
+                  bgcolor="#1e1e1e" if theme=="dark" else "#fafafa",
+                  font_color="#fff" if theme=="dark" else "#000")
+    if not physics: net.toggle_physics(False)
+    if layout=="hierarchical":
+        net.set_options('{"layout":{"hierarchical":{"enabled":true,"direction":"UD"}}}')
+    if physics and layout=="force":
+        net.set_options(f'{{"physics":{{"barnesHut":{{"springLength":{spring},"gravitationalConstant":{-repel}}}}}}}')
+
+    # Fill pyvis' node/edge tables in one go; add_node/add_edge re-validate
+    # and scan the node list on every call
+    net.nodes = [{"id": n, "label": cut(n, lablen), "shape": "dot",
+                  "color": "#3d85c6" if "Runner" in n else "#6aa84f",
+                  "font": {"color": net.font_color}} for n in nodes]
+    if layout=="circular":
+        circ = nx.circular_layout(list(nodes), scale=350)
+        for nd in net.nodes:
+            x,y = circ[nd["id"]]; nd.update(x=float(x), y=float(y), fixed=True)
+    net.node_ids = list(nodes)
+    net.node_map = {nd["id"]: nd for nd in net.nodes}
+    net.edges = [{"from": u, "to": v, "value": w,
+                  "title": f"{u}→{v}<br>{typ} × {w}",
+                  "color": color, "arrows": "to" if arrows else ""}
+                 for u,v,w,typ,color in edges]
+    return net.generate_html()
+
 # ─── UI skeleton ────────────────────────────────────────────────
 st.set_page_config("🤖 Capability Event Dashboard", layout="wide")
 
@@ -111,8 +220,7 @@ with edit:
 
 # Parse JSON
 try:
-    raw = json.loads(raw_text)
-    df_all = parse_events(raw)
+    df_all = parse_events(raw_text)
 except Exception as e:
     dash.error(e); st.stop()
 
@@ -128,8 +236,7 @@ with st.sidebar:
     window = st.slider("Time window (s)", 0.0, float(t_max),
                        (0.0, float(t_max)), 0.1)
     regex = st.text_input("Capability regex")
-    ecount = df_all.groupby(["source","target"]).size().reset_index(name="w")
-    min_w = st.slider("Min edge weight", 1, int(ecount.w.max()), 1)
+    min_w = st.slider("Min edge weight", 1, max(edge_counts(raw_text).values()), 1)
 
     st.markdown("## 🎨 Style")
     theme  = st.selectbox("Theme", ["light","dark"])
@@ -141,8 +248,14 @@ with st.sidebar:
     arrows = st.checkbox("Arrows",True)
     lablen = st.slider("Label length",0,40,20)
 
-    st.markdown("### Palette")
-    palette = {t: st.color_picker(t, f"#{hash(t)&0xFFFFFF:06x}") for t in types_all}
+    # Defaults live in session_state; pickers are only built while editing
+    if "palette" not in st.session_state: st.session_state.palette = {}
+    palette = st.session_state.palette
+    for t in types_all: palette.setdefault(t, f"#{hash(t)&0xFFFFFF:06x}")
+    with st.expander("Palette"):
+        if st.checkbox("Edit colours", key="pal_edit"):
+            for t in types_all:
+                palette[t] = st.color_picker(t, palette[t], key=f"pal_{t}")
 
 # Playback controls
 with st.sidebar:
@@ -161,14 +274,25 @@ with st.sidebar:
                                      st.session_state.now, step)
 
 # Apply filters
-df = df_all[
-    (df_all.type.isin(sel_types)) &
-    (df_all.timestamp.between(window[0], window[1])) &
-    (df_all.timestamp <= st.session_state.now)
-]
+# df_all is sorted by timestamp, so the time filter is a binary-search slice
+ts = df_all.timestamp.to_numpy()
+lo = ts.searchsorted(window[0], side="left")
+hi = ts.searchsorted(min(window[1], st.session_state.now), side="right")
+df = df_all.iloc[lo:hi]
+df = df[df.type.isin(sel_types)]
 df = safe_regex(df, regex)
 
-G, edges = build_graph(df, min_w)
+# Playback only ever reveals later events, so edge counts live in session_state
+# and are topped up from the new rows instead of regrouping every frame
+inc_key = (hash(raw_text), int(lo), tuple(sel_types), regex)
+inc = st.session_state.get("inc")
+if inc is None or inc["key"] != inc_key or hi < inc["hi"]:
+    inc = st.session_state.inc = dict(key=inc_key, hi=int(lo), counts=Counter())
+new = df.iloc[df.index.searchsorted(inc["hi"]):]
+inc["counts"].update(pair_counts(new))
+inc["hi"] = int(hi)
+
+G, edges = build_graph(inc["counts"], min_w)
 deg_c, btw_c, eig_c = centralities(G)
 
 # Dashboard tab
@@ -186,31 +310,14 @@ with dash:
     st.subheader("Network")
     if not G.nodes: st.info("Graph empty.")
     else:
-        net = Network(height=f"{NET_HEIGHT}px", width="100%", directed=True,
-                      bgcolor="#1e1e1e" if theme=="dark" else "#fafafa",
-                      font_color="#fff" if theme=="dark" else "#000")
-        if not physics: net.toggle_physics(False)
-        if layout=="hierarchical":
-            net.set_options('{"layout":{"hierarchical":{"enabled":true,"direction":"UD"}}}')
-        elif layout=="circular":
-            circ = nx.circular_layout(G, scale=350)
-        if physics and layout=="force":
-            net.set_options(f'{{"physics":{{"barnesHut":{{"springLength":{spring},"gravitationalConstant":{-repel}}}}}}}')
-
-        for n in G.nodes():
-            label = cut(n, lablen)
-            color = "#3d85c6" if "Runner" in n else "#6aa84f"
-            if layout=="circular":
-                x,y = circ[n]; net.add_node(n,label=label,color=color,x=x,y=y,fixed=True)
-            else:
-                net.add_node(n,label=label,color=color)
-        for u,v,d in G.edges(data=True):
-            typ = df[(df.source==u)&(df.target==v)].type.mode().iat[0]
-            color = palette.get(typ,"#888")
-            net.add_edge(u,v,value=d["weight"],
-                         title=f"{u}→{v}<br>{typ} × {d['weight']}",
-                         color=color, arrows="to" if arrows else "")
-        html(net.generate_html(), height=NET_HEIGHT, scrolling=True)
+        mode_type = (df.groupby(["source","target"]).type
+                       .agg(lambda t: t.mode().iat[0]).to_dict())
+        edge_key = tuple((u, v, w, mode_type[(u,v)], palette.get(mode_type[(u,v)], "#888"))
+                         for u,v,w in G.edges(data="weight"))
+        style = (theme, layout, physics, arrows, lablen,
+                 spring if physics else None, repel if physics else None)
+        html(render_net(tuple(G.nodes()), edge_key, style),
+             height=NET_HEIGHT, scrolling=True)
 
 # Inspector tab
 with insp:
@@ -238,9 +345,12 @@ with insp:
 with table:
     st.markdown(f"<h3 style='color:{ACCENT}'>Filtered events</h3>",
                 unsafe_allow_html=True)
-    st.dataframe(df, use_container_width=True)
+    # Every shown row is shipped to the browser on each rerun; cap by default
+    shown = df if st.checkbox("Render all rows") else df.head(TABLE_ROWS)
+    st.caption(f"Showing {len(shown)}/{len(df)}")
+    st.dataframe(shown, use_container_width=True)
     st.download_button("Download CSV",
-                       df.to_csv(index=False).encode(),
+                       csv_bytes(df),
                        "events_filtered.csv")
 
 # Analytics tab (with NEW charts)
@@ -290,8 +400,9 @@ with stat:
                                        values="w", fill_value=0))
         st.subheader("Sankey")
         node_list = list(G.nodes())
-        src_i = [node_list.index(s) for s in edges.source]
-        tgt_i = [node_list.index(t) for t in edges.target]
+        idx = {n:i for i,n in enumerate(node_list)}
+        src_i = edges.source.map(idx).to_numpy()
+        tgt_i = edges.target.map(idx).to_numpy()
         st.plotly_chart(go.Figure(go.Sankey(
             node=dict(label=node_list, pad=15, thickness=18),
             link=dict(source=src_i, target=tgt_i, value=edges.w)